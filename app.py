@@ -2,8 +2,13 @@ import streamlit as st
 import os
 from quiz_generator import QuizGenerator
 from pdf_processor import PDFProcessor
-from utils import export_quiz_to_pdf, export_quiz_to_text
+from utils import export_quiz_to_pdf, export_quiz_to_text, escape_markup
 import tempfile
+import shutil
+import hashlib
+import json
+import atexit
+import time
 
 # Page configuration
 st.set_page_config(
@@ -117,55 +122,255 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
-# Initialize session state
-if 'quiz_data' not in st.session_state:
-    st.session_state.quiz_data = None
-if 'pdf_processed' not in st.session_state:
-    st.session_state.pdf_processed = False
-if 'extracted_text' not in st.session_state:
-    st.session_state.extracted_text = ""
+@st.cache_resource(show_spinner=False)
+def get_quiz_generator(api_key: str) -> QuizGenerator:
+    """Keep one QuizGenerator (and its Gemini client) alive across reruns."""
+    return QuizGenerator(api_key)
 
-# Sidebar
-with st.sidebar:
-    st.markdown("### 📋 Quiz Configuration")
+def get_file_digest(uploaded_file) -> str:
+    """Hash an uploaded file in chunks so identical PDFs share cache entries."""
+    # Reruns keep the same upload, so only hash it once per file_id
+    cached = st.session_state.file_digest
+    if cached is not None and cached[0] == uploaded_file.file_id:
+        return cached[1]
     
-    # PDF Upload
-    st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
-    st.markdown("**📄 Upload PDF Chapter**")
-    uploaded_file = st.file_uploader(
-        "Choose a PDF file",
-        type=['pdf'],
-        help="Upload a PDF chapter to generate quiz questions from"
+    digest = hashlib.blake2b()
+    uploaded_file.seek(0)
+    for chunk in iter(lambda: uploaded_file.read(1 << 20), b""):
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    
+    st.session_state.file_digest = (uploaded_file.file_id, digest.hexdigest())
+    return st.session_state.file_digest[1]
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def extract_pdf_text(file_digest: str, _uploaded_file) -> str:
+    """
+    Extract text from an uploaded PDF, cached on the file's content hash.
+    
+    Raises instead of returning PDFProcessor's error message, so a failed
+    extraction is neither cached nor mistaken for the PDF's text.
+    """
+    # Save uploaded file temporarily
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
+        _uploaded_file.seek(0)
+        shutil.copyfileobj(_uploaded_file, tmp_file, length=1 << 20)
+        tmp_file_path = tmp_file.name
+    
+    pdf_processor = PDFProcessor()
+    try:
+        text = pdf_processor.extract_text_from_pdf(tmp_file_path)
+    finally:
+        # Release the file before deleting it (required on Windows)
+        pdf_processor.close()
+        os.unlink(tmp_file_path)
+    
+    # PDFProcessor reports failures as text
+    if text.startswith("Error processing PDF:"):
+        raise ValueError(text[len("Error processing PDF:"):].strip())
+    if text == "No readable text could be extracted from this PDF.":
+        return ""
+    return text
+
+def generate_quiz_cached(text_digest: str, num_questions: int, difficulty: str, question_types: tuple,
+                         quiz_generator: QuizGenerator, text_path: str, on_question=None,
+                         regenerate: bool = False) -> list:
+    """
+    Generate a quiz, cached on the source text hash and quiz settings.
+    
+    Results are memoized in session state rather than with st.cache_data so a
+    cache miss can stream questions into the page while they are generated.
+    Pass regenerate=True to skip the cache and replace its entry with a new quiz.
+    """
+    cache_key = (text_digest, num_questions, difficulty, question_types)
+    if not regenerate and cache_key in st.session_state.quiz_cache:
+        return st.session_state.quiz_cache[cache_key]
+    
+    # The extracted text is only read from disk on a cache miss
+    with open(text_path, 'r', encoding='utf-8') as text_file:
+        text = text_file.read()
+    # Mark the file as in use so it is not pruned
+    os.utime(text_path)
+    
+    quiz_data = quiz_generator.generate_quiz(
+        text=text,
+        num_questions=num_questions,
+        difficulty=difficulty,
+        question_types=list(question_types),
+        on_question=on_question
     )
-    st.markdown('</div>', unsafe_allow_html=True)
     
-    # Quiz Settings
+    # Don't keep a failed generation around for the next click
+    if quiz_data:
+        st.session_state.quiz_cache[cache_key] = quiz_data
+    return quiz_data
+
+# Extracted text files untouched for this long belong to abandoned sessions
+_TEXT_FILE_MAX_AGE = 24 * 60 * 60
+
+@st.cache_resource(show_spinner=False)
+def get_text_dir() -> str:
+    """Directory holding every session's extracted text, removed when the server exits."""
+    text_dir = tempfile.mkdtemp(prefix="quiz_text_")
+    atexit.register(shutil.rmtree, text_dir, ignore_errors=True)
+    return text_dir
+
+def prune_text_files(text_dir: str) -> None:
+    """Delete extracted text files that have not been used for _TEXT_FILE_MAX_AGE seconds."""
+    cutoff = time.time() - _TEXT_FILE_MAX_AGE
+    for entry in os.scandir(text_dir):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.unlink(entry.path)
+        except OSError:
+            pass
+
+def save_extracted_text(extracted_text: str) -> None:
+    """Write extracted text to a temporary file and remember its path in session state."""
+    text_dir = get_text_dir()
+    prune_text_files(text_dir)
+    
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', delete=False, suffix=".txt", dir=text_dir) as text_file:
+        text_file.write(extracted_text)
+    
+    # Remove the text of the previously processed PDF
+    previous_path = st.session_state.extracted_text_path
+    if previous_path and os.path.exists(previous_path):
+        os.unlink(previous_path)
+    
+    st.session_state.extracted_text_path = text_file.name
+
+def discard_extracted_text() -> None:
+    """Forget the previously processed PDF so a failed upload cannot be quizzed on stale text."""
+    previous_path = st.session_state.extracted_text_path
+    if previous_path and os.path.exists(previous_path):
+        os.unlink(previous_path)
+    st.session_state.extracted_text_path = None
+    st.session_state.text_preview = ""
+    st.session_state.pdf_processed = False
+
+def get_quiz_digest(quiz_data: list) -> str:
+    """Hash quiz data so its exports can be cached."""
+    return hashlib.blake2b(json.dumps(quiz_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def build_quiz_pdf(quiz_digest: str, include_answer_key: bool, _quiz_data: list) -> bytes:
+    """Render the quiz PDF once per quiz."""
+    return export_quiz_to_pdf(_quiz_data, include_answer_key=include_answer_key).getvalue()
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def build_quiz_text(quiz_digest: str, _quiz_data: list) -> str:
+    """Render the quiz text export once per quiz."""
+    return export_quiz_to_text(_quiz_data)
+
+@st.fragment
+def render_quiz_settings() -> None:
+    """Quiz settings widgets; changing them only reruns this fragment."""
     st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
     st.markdown("**⚙️ Quiz Settings**")
-    
-    num_questions = st.slider(
+
+    st.slider(
         "Number of Questions",
         min_value=5,
         max_value=50,
         value=15,
         step=5,
-        help="Select how many questions to generate"
+        help="Select how many questions to generate",
+        key="num_questions"
     )
-    
-    difficulty_level = st.selectbox(
+
+    st.selectbox(
         "Difficulty Level",
         options=["Easy", "Medium", "Hard"],
         index=1,
-        help="Choose the difficulty level for questions"
+        help="Choose the difficulty level for questions",
+        key="difficulty_level"
     )
-    
-    question_types = st.multiselect(
+
+    st.multiselect(
         "Question Types",
         options=["Multiple Choice", "True/False"],
         default=["Multiple Choice", "True/False"],
-        help="Select types of questions to generate"
+        help="Select types of questions to generate",
+        key="question_types"
     )
     st.markdown('</div>', unsafe_allow_html=True)
+
+@st.fragment
+def render_quiz(quiz_data: list) -> None:
+    """Display the generated quiz in its own fragment."""
+    st.markdown("### 📝 Generated Quiz")
+    
+    # Build the whole quiz as one HTML block so it is sent as a single element;
+    # model text is escaped since the block is rendered with unsafe_allow_html
+    html_parts = []
+    for i, question in enumerate(quiz_data, 1):
+        html_parts.append(
+            f'<div class="quiz-card">'
+            f'<div class="question-number">Question {i}</div>'
+            f'<h4>{escape_markup(question["question"])}</h4>'
+        )
+        
+        if question['type'] == 'multiple_choice':
+            for j, option in enumerate(question['options']):
+                option_letter = chr(65 + j)  # A, B, C, D
+                is_correct = option_letter == question['correct_answer']
+                style = "font-weight: bold; color: #22c55e;" if is_correct else ""
+                html_parts.append(f"<p style='{style}'>{option_letter}. {escape_markup(option)}</p>")
+        
+        elif question['type'] == 'true_false':
+            correct_answer = question['correct_answer']
+            html_parts.append(f"<p><strong>True</strong> {'✅' if correct_answer == 'True' else ''}</p>")
+            html_parts.append(f"<p><strong>False</strong> {'✅' if correct_answer == 'False' else ''}</p>")
+        
+        html_parts.append(
+            f'<div class="correct-answer">'
+            f'<strong>Correct Answer:</strong> {escape_markup(question["correct_answer"])}'
+            f'<br><strong>Explanation:</strong> {escape_markup(question.get("explanation", "No explanation provided."))}'
+            f'</div></div>'
+        )
+    
+    st.markdown("".join(html_parts), unsafe_allow_html=True)
+
+# Initialize session state
+if 'quiz_data' not in st.session_state:
+    st.session_state.quiz_data = None
+if 'pdf_processed' not in st.session_state:
+    st.session_state.pdf_processed = False
+if 'extracted_text_path' not in st.session_state:
+    st.session_state.extracted_text_path = None
+if 'text_preview' not in st.session_state:
+    st.session_state.text_preview = ""
+if 'file_digest' not in st.session_state:
+    st.session_state.file_digest = None
+if 'pdf_digest' not in st.session_state:
+    st.session_state.pdf_digest = None
+if 'pdf_error' not in st.session_state:
+    st.session_state.pdf_error = None
+if 'quiz_digest' not in st.session_state:
+    st.session_state.quiz_digest = None
+if 'quiz_cache' not in st.session_state:
+    st.session_state.quiz_cache = {}
+
+# Sidebar
+with st.sidebar:
+    st.markdown("### 📋 Quiz Configuration")
+    
+    # PDF Upload
+    st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
+    st.markdown("**📄 Upload PDF Chapter**")
+    uploaded_file = st.file_uploader(
+        "Choose a PDF file",
+        type=['pdf'],
+        help="Upload a PDF chapter to generate quiz questions from"
+    )
+    st.markdown('</div>', unsafe_allow_html=True)
+    
+    # Quiz Settings
+    render_quiz_settings()
+    num_questions = st.session_state.num_questions
+    difficulty_level = st.session_state.difficulty_level
+    question_types = st.session_state.question_types
     
     # API Configuration
     st.markdown('<div class="sidebar-section">', unsafe_allow_html=True)
@@ -186,58 +391,91 @@ with st.sidebar:
 col1, col2 = st.columns([2, 1])
 
 with col1:
-    # Process PDF when uploaded
-    if uploaded_file is not None and not st.session_state.pdf_processed:
+    # Process PDF when a new file is uploaded, or when its extracted text was
+    # pruned from disk after sitting unused
+    file_digest = get_file_digest(uploaded_file) if uploaded_file is not None else None
+    text_pruned = st.session_state.pdf_processed and not os.path.exists(st.session_state.extracted_text_path)
+    if file_digest is not None and (file_digest != st.session_state.pdf_digest or text_pruned):
         with st.spinner("🔄 Processing PDF..."):
             try:
-                # Save uploaded file temporarily
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-                    tmp_file.write(uploaded_file.getvalue())
-                    tmp_file_path = tmp_file.name
-                
-                # Process PDF
-                pdf_processor = PDFProcessor()
-                extracted_text = pdf_processor.extract_text_from_pdf(tmp_file_path)
+                extracted_text = extract_pdf_text(file_digest, uploaded_file)
                 
                 if extracted_text.strip():
-                    st.session_state.extracted_text = extracted_text
+                    # Keep the full text on disk so session state only carries a path
+                    save_extracted_text(extracted_text)
+                    st.session_state.text_preview = extracted_text[:1000] + "..." if len(extracted_text) > 1000 else extracted_text
                     st.session_state.pdf_processed = True
+                    st.session_state.pdf_digest = file_digest
+                    st.session_state.pdf_error = None
                     st.markdown('<div class="success-message">✅ PDF processed successfully!</div>', unsafe_allow_html=True)
                     
                     # Show text preview
                     with st.expander("📖 Preview Extracted Text"):
                         st.text_area(
                             "Extracted content:",
-                            value=extracted_text[:1000] + "..." if len(extracted_text) > 1000 else extracted_text,
+                            value=st.session_state.text_preview,
                             height=200,
                             disabled=True
                         )
                 else:
-                    st.markdown('<div class="error-message">❌ No text could be extracted from the PDF. Please ensure the PDF contains readable text.</div>', unsafe_allow_html=True)
-                
-                # Cleanup
-                os.unlink(tmp_file_path)
+                    st.session_state.pdf_error = "❌ No text could be extracted from the PDF. Please ensure the PDF contains readable text."
                 
             except Exception as e:
-                st.markdown(f'<div class="error-message">❌ Error processing PDF: {str(e)}</div>', unsafe_allow_html=True)
+                st.session_state.pdf_error = f"❌ Error processing PDF: {str(e)}"
+            
+            if st.session_state.pdf_error:
+                # Drop the previous PDF's text and remember the failed upload so
+                # reruns neither quiz on stale text nor extract it again
+                discard_extracted_text()
+                st.session_state.pdf_digest = file_digest
+    
+    if file_digest is not None and st.session_state.pdf_error:
+        st.markdown(f'<div class="error-message">{st.session_state.pdf_error}</div>', unsafe_allow_html=True)
     
     # Generate Quiz Button
     if st.session_state.pdf_processed and api_key:
         st.markdown("### 🚀 Generate Quiz")
         
-        if st.button("🎯 Generate Quiz Questions", use_container_width=True):
+        generate_clicked = st.button("🎯 Generate Quiz Questions", use_container_width=True)
+        # Generating again with unchanged settings returns the cached quiz, so
+        # offer a way to ask for different questions
+        regenerate_clicked = bool(st.session_state.quiz_data) and st.button(
+            "🔄 Regenerate with New Questions",
+            use_container_width=True,
+            help="Generate a different quiz with the same settings"
+        )
+        
+        if generate_clicked or regenerate_clicked:
             with st.spinner("🤖 Generating quiz questions with AI..."):
                 try:
-                    quiz_generator = QuizGenerator(api_key)
-                    quiz_data = quiz_generator.generate_quiz(
-                        text=st.session_state.extracted_text,
-                        num_questions=num_questions,
-                        difficulty=difficulty_level,
-                        question_types=question_types
+                    quiz_generator = get_quiz_generator(api_key)
+                    
+                    # Show questions as they stream in
+                    progress = st.empty()
+                    streamed_questions = []
+                    
+                    def show_progress(question):
+                        streamed_questions.append(question)
+                        progress.markdown(
+                            f"✍️ {len(streamed_questions)} of {num_questions} questions written. "
+                            f"Latest: *{question['question']}*"
+                        )
+                    
+                    quiz_data = generate_quiz_cached(
+                        st.session_state.pdf_digest,
+                        num_questions,
+                        difficulty_level,
+                        tuple(question_types),
+                        quiz_generator,
+                        st.session_state.extracted_text_path,
+                        on_question=show_progress,
+                        regenerate=regenerate_clicked
                     )
+                    progress.empty()
                     
                     if quiz_data:
                         st.session_state.quiz_data = quiz_data
+                        st.session_state.quiz_digest = get_quiz_digest(quiz_data)
                         st.markdown('<div class="success-message">🎉 Quiz generated successfully!</div>', unsafe_allow_html=True)
                     else:
                         st.markdown('<div class="error-message">❌ Failed to generate quiz. Please try again.</div>', unsafe_allow_html=True)
@@ -250,66 +488,37 @@ with col2:
     if st.session_state.quiz_data:
         st.markdown("### 📥 Download Quiz")
         
+        include_answer_key = st.checkbox("Include answer key in PDF", value=True)
+        
         col_pdf, col_txt = st.columns(2)
         
         with col_pdf:
-            if st.button("📄 Download PDF", use_container_width=True):
-                try:
-                    pdf_buffer = export_quiz_to_pdf(st.session_state.quiz_data)
-                    st.download_button(
-                        label="💾 Save PDF",
-                        data=pdf_buffer,
-                        file_name="quiz.pdf",
-                        mime="application/pdf",
-                        use_container_width=True
-                    )
-                except Exception as e:
-                    st.error(f"Error creating PDF: {str(e)}")
+            try:
+                st.download_button(
+                    label="📄 Download PDF",
+                    data=build_quiz_pdf(st.session_state.quiz_digest, include_answer_key, st.session_state.quiz_data),
+                    file_name="quiz.pdf",
+                    mime="application/pdf",
+                    use_container_width=True
+                )
+            except Exception as e:
+                st.error(f"Error creating PDF: {str(e)}")
         
         with col_txt:
-            if st.button("📝 Download Text", use_container_width=True):
-                try:
-                    text_content = export_quiz_to_text(st.session_state.quiz_data)
-                    st.download_button(
-                        label="💾 Save Text",
-                        data=text_content,
-                        file_name="quiz.txt",
-                        mime="text/plain",
-                        use_container_width=True
-                    )
-                except Exception as e:
-                    st.error(f"Error creating text file: {str(e)}")
+            try:
+                st.download_button(
+                    label="📝 Download Text",
+                    data=build_quiz_text(st.session_state.quiz_digest, st.session_state.quiz_data),
+                    file_name="quiz.txt",
+                    mime="text/plain",
+                    use_container_width=True
+                )
+            except Exception as e:
+                st.error(f"Error creating text file: {str(e)}")
 
 # Display Generated Quiz
 if st.session_state.quiz_data:
-    st.markdown("### 📝 Generated Quiz")
-    
-    for i, question in enumerate(st.session_state.quiz_data, 1):
-        st.markdown(f"""
-        <div class="quiz-card">
-            <div class="question-number">Question {i}</div>
-            <h4>{question['question']}</h4>
-        """, unsafe_allow_html=True)
-        
-        if question['type'] == 'multiple_choice':
-            for j, option in enumerate(question['options']):
-                option_letter = chr(65 + j)  # A, B, C, D
-                is_correct = option_letter == question['correct_answer']
-                style = "font-weight: bold; color: #22c55e;" if is_correct else ""
-                st.markdown(f"<p style='{style}'>{option_letter}. {option}</p>", unsafe_allow_html=True)
-        
-        elif question['type'] == 'true_false':
-            correct_answer = question['correct_answer']
-            st.markdown(f"<p><strong>True</strong> {'✅' if correct_answer == 'True' else ''}</p>", unsafe_allow_html=True)
-            st.markdown(f"<p><strong>False</strong> {'✅' if correct_answer == 'False' else ''}</p>", unsafe_allow_html=True)
-        
-        st.markdown(f"""
-            <div class="correct-answer">
-                <strong>Correct Answer:</strong> {question['correct_answer']}
-                <br><strong>Explanation:</strong> {question.get('explanation', 'No explanation provided.')}
-            </div>
-        </div>
-        """, unsafe_allow_html=True)
+    render_quiz(st.session_state.quiz_data)
 
 # Footer
 st.markdown("---")
@@ -0,0 +1,40 @@
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+class _RootForwardingHandler(logging.Handler):
+    """Pass records to whatever handlers the root logger has when they are emitted."""
+    
+    def emit(self, record: logging.LogRecord) -> None:
+        logging.getLogger().handle(record)
+
+_log_queue = queue.SimpleQueue()
+_log_listener = None
+
+def get_background_logger(name: str) -> logging.Logger:
+    """
+    Get a logger whose records are written by a background thread.
+    
+    Records are queued by the calling thread and handed to the root logger's
+    handlers by a single QueueListener thread, so slow (e.g. remote) handlers
+    don't block quiz generation or PDF processing.
+    
+    Args:
+        name: Logger name, usually __name__
+        
+    Returns:
+        The configured logger
+    """
+    global _log_listener
+    if _log_listener is None:
+        _log_listener = QueueListener(_log_queue, _RootForwardingHandler())
+        _log_listener.start()
+        atexit.register(_log_listener.stop)
+    
+    logger = logging.getLogger(name)
+    if not any(isinstance(handler, QueueHandler) for handler in logger.handlers):
+        logger.addHandler(QueueHandler(_log_queue))
+        # The listener forwards to the root handlers, so don't propagate twice
+        logger.propagate = False
+    return logger
@@ -1,17 +1,64 @@
 import os
+import re
 import tempfile
-import logging
+import shutil
+import threading
+import weakref
 from typing import Optional
+import importlib.util
 import PyPDF2
+import pypdfium2 as pdfium
 from io import BytesIO
+from log_utils import get_background_logger
+
+logger = get_background_logger(__name__)
+
+# Lines that are at most two characters long once surrounding whitespace is stripped
+_SHORT_LINE_RE = re.compile(r'^[^\S\n]*\S{0,2}[^\S\n]*(?:\n|$)', re.MULTILINE)
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# PDFium is not thread-safe, and Streamlit runs each session in its own thread,
+# so every PDFium call goes through this lock
+_PDFIUM_LOCK = threading.Lock()
 
 # Note: unstructured library would be ideal but may not be available
-# This implementation uses PyPDF2 as a fallback with enhanced text extraction
+# This implementation uses PDFium for text extraction, with PyPDF2 as a fallback
+# for PDFs that PDFium cannot read
 
 class PDFProcessor:
     def __init__(self):
         """Initialize the PDF processor."""
-        self.logger = logging.getLogger(__name__)
+        self.logger = logger
+        # Parsed PyPDF2 readers keyed on file path, reused while the file is unchanged
+        self._readers = {}
+    
+    def _open_reader(self, file_path: str) -> PyPDF2.PdfReader:
+        """Return a parsed PdfReader for the file, reusing it until the file changes."""
+        mtime = os.stat(file_path).st_mtime_ns
+        cached = self._readers.get(file_path)
+        if cached is not None:
+            if cached[0] == mtime:
+                return cached[1]
+            cached[2].close()
+        
+        file = open(file_path, 'rb')
+        try:
+            pdf_reader = PyPDF2.PdfReader(file)
+        except Exception:
+            file.close()
+            raise
+        
+        # Backstop for processors that are never closed; PdfReader has reference
+        # cycles, so this only runs once the cyclic garbage collector gets to it
+        weakref.finalize(pdf_reader, file.close)
+        self._readers[file_path] = (mtime, pdf_reader, file)
+        return pdf_reader
+    
+    def close(self) -> None:
+        """Close the files behind all cached readers; call before deleting a processed file."""
+        while self._readers:
+            _, (_, _, file) = self._readers.popitem()
+            file.close()
     
     def extract_text_from_pdf(self, file_path: str) -> str:
         """
@@ -24,7 +71,12 @@ class PDFProcessor:
             Extracted text content
         """
         try:
-            # Use PyPDF2 for text extraction
+            # Use PDFium for text extraction
+            text = self._extract_with_pdfium(file_path)
+            if text and len(text.strip()) > 50:
+                return text
+            
+            # Fall back to PyPDF2 for PDFs that PDFium could not read
             text = self._extract_with_pypdf2(file_path)
             if text and len(text.strip()) > 50:
                 return text
@@ -37,11 +89,14 @@ class PDFProcessor:
             return "No readable text could be extracted from this PDF."
             
         except Exception as e:
-            self.logger.error(f"Error extracting text from PDF: {e}")
+            self.logger.error("Error extracting text from PDF: %s", e)
             return f"Error processing PDF: {str(e)}"
     
     def _extract_with_unstructured(self, file_path: str) -> Optional[str]:
         """Extract text using unstructured library (if available)."""
+        if importlib.util.find_spec("unstructured") is None:
+            return None
+        
         try:
             # Import unstructured libraries if available
             from unstructured.partition.pdf import partition_pdf
@@ -67,60 +122,84 @@ class PDFProcessor:
             self.logger.info("Unstructured library not available")
             return None
         except Exception as e:
-            self.logger.error(f"Error with unstructured extraction: {e}")
+            self.logger.error("Error with unstructured extraction: %s", e)
+            return None
+    
+    def _extract_with_pdfium(self, file_path: str) -> Optional[str]:
+        """Extract text using PDFium (pypdfium2)."""
+        try:
+            page_texts = []
+            with _PDFIUM_LOCK:
+                pdf = pdfium.PdfDocument(file_path)
+                try:
+                    # Extract the raw text of each page
+                    for page_num, page in enumerate(pdf):
+                        try:
+                            textpage = page.get_textpage()
+                            page_texts.append((page_num, textpage.get_text_range()))
+                            textpage.close()
+                        except Exception as e:
+                            self.logger.warning("Error extracting text from page %d: %s", page_num + 1, e)
+                        finally:
+                            page.close()
+                finally:
+                    pdf.close()
+            
+            # Clean up the text outside the lock
+            text_content = []
+            for page_num, page_text in page_texts:
+                if page_text.strip():
+                    cleaned_text = self._clean_extracted_text(page_text)
+                    if cleaned_text:
+                        text_content.append(f"--- Page {page_num + 1} ---\n{cleaned_text}")
+            
+            return "\n\n".join(text_content)
+            
+        except Exception as e:
+            self.logger.error("Error with PDFium extraction: %s", e)
             return None
     
     def _extract_with_pypdf2(self, file_path: str) -> str:
         """Extract text using PyPDF2 as fallback."""
         try:
+            pdf_reader = self._open_reader(file_path)
             text_content = []
             
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                
-                # Extract text from each page
-                for page_num, page in enumerate(pdf_reader.pages):
-                    try:
-                        page_text = page.extract_text()
-                        if page_text.strip():
-                            # Clean up the text
-                            cleaned_text = self._clean_extracted_text(page_text)
-                            if cleaned_text:
-                                text_content.append(f"--- Page {page_num + 1} ---\n{cleaned_text}")
-                    except Exception as e:
-                        self.logger.warning(f"Error extracting text from page {page_num + 1}: {e}")
-                        continue
+            # Extract text from each page
+            for page_num in range(len(pdf_reader.pages)):
+                page_text = self._extract_one_page(pdf_reader, page_num)
+                if page_text:
+                    text_content.append(page_text)
             
             return "\n\n".join(text_content)
             
         except Exception as e:
-            self.logger.error(f"Error with PyPDF2 extraction: {e}")
+            self.logger.error("Error with PyPDF2 extraction: %s", e)
             raise
     
+    def _extract_one_page(self, pdf_reader: PyPDF2.PdfReader, page_num: int) -> Optional[str]:
+        """Extract and clean the text of a single page."""
+        try:
+            page_text = pdf_reader.pages[page_num].extract_text()
+            if page_text.strip():
+                # Clean up the text
+                cleaned_text = self._clean_extracted_text(page_text)
+                if cleaned_text:
+                    return f"--- Page {page_num + 1} ---\n{cleaned_text}"
+        except Exception as e:
+            self.logger.warning("Error extracting text from page %d: %s", page_num + 1, e)
+        return None
+    
     def _clean_extracted_text(self, text: str) -> str:
         """Clean and normalize extracted text."""
         if not text:
             return ""
         
-        # Basic text cleaning
-        lines = text.split('\n')
-        cleaned_lines = []
-        
-        for line in lines:
-            line = line.strip()
-            if line and len(line) > 2:  # Filter out very short lines
-                # Remove excessive whitespace
-                line = ' '.join(line.split())
-                cleaned_lines.append(line)
-        
-        # Join lines back together
-        cleaned_text = ' '.join(cleaned_lines)
-        
-        # Additional cleaning
-        cleaned_text = cleaned_text.replace('\x00', '')  # Remove null characters
-        cleaned_text = ' '.join(cleaned_text.split())    # Normalize whitespace
-        
-        return cleaned_text
+        # Drop very short lines, remove null characters, then collapse all
+        # whitespace (including line breaks) to single spaces
+        text = _SHORT_LINE_RE.sub('', text)
+        text = text.replace('\x00', '')
+        return _WHITESPACE_RE.sub(' ', text).strip()
     
     def extract_text_from_uploaded_file(self, uploaded_file) -> str:
         """
@@ -135,19 +214,23 @@ class PDFProcessor:
         try:
             # Create a temporary file
             with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-                tmp_file.write(uploaded_file.getvalue())
+                uploaded_file.seek(0)
+                shutil.copyfileobj(uploaded_file, tmp_file, length=1 << 20)
                 tmp_file_path = tmp_file.name
             
             # Extract text
-            text = self.extract_text_from_pdf(tmp_file_path)
-            
-            # Clean up temporary file
-            os.unlink(tmp_file_path)
+            try:
+                text = self.extract_text_from_pdf(tmp_file_path)
+            finally:
+                # Release the file before deleting it (required on Windows)
+                self.close()
+                # Clean up temporary file
+                os.unlink(tmp_file_path)
             
             return text
             
         except Exception as e:
-            self.logger.error(f"Error processing uploaded file: {e}")
+            self.logger.error("Error processing uploaded file: %s", e)
             return f"Error processing uploaded file: {str(e)}"
     
     def validate_pdf(self, file_path: str) -> bool:
@@ -161,12 +244,11 @@ class PDFProcessor:
             True if valid PDF, False otherwise
         """
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                # Try to access the first page
-                if len(pdf_reader.pages) > 0:
-                    _ = pdf_reader.pages[0]
-                    return True
+            pdf_reader = self._open_reader(file_path)
+            # Try to access the first page
+            if len(pdf_reader.pages) > 0:
+                _ = pdf_reader.pages[0]
+                return True
             return False
         except Exception:
             return False
@@ -182,25 +264,24 @@ class PDFProcessor:
             Dictionary with PDF information
         """
         try:
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                
-                info = {
-                    'num_pages': len(pdf_reader.pages),
-                    'title': '',
-                    'author': '',
-                    'subject': '',
-                    'file_size': os.path.getsize(file_path)
-                }
-                
-                # Try to get metadata
-                if pdf_reader.metadata:
-                    info['title'] = pdf_reader.metadata.get('/Title', '')
-                    info['author'] = pdf_reader.metadata.get('/Author', '')
-                    info['subject'] = pdf_reader.metadata.get('/Subject', '')
-                
-                return info
-                
+            pdf_reader = self._open_reader(file_path)
+            
+            info = {
+                'num_pages': len(pdf_reader.pages),
+                'title': '',
+                'author': '',
+                'subject': '',
+                'file_size': os.path.getsize(file_path)
+            }
+            
+            # Try to get metadata
+            if pdf_reader.metadata:
+                info['title'] = pdf_reader.metadata.get('/Title', '')
+                info['author'] = pdf_reader.metadata.get('/Author', '')
+                info['subject'] = pdf_reader.metadata.get('/Subject', '')
+            
+            return info
+            
         except Exception as e:
-            self.logger.error(f"Error getting PDF info: {e}")
+            self.logger.error("Error getting PDF info: %s", e)
             return {'error': str(e)}
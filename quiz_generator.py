@@ -1,78 +1,258 @@
+import functools
 import json
-import logging
+import queue
+import random
 import re
-from typing import List, Dict, Any, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Callable, Literal, Optional, Tuple
 from google import genai
-from google.genai import types
+from google.genai import errors, types
+from pydantic import BaseModel
 import os
+from log_utils import get_background_logger
+
+logger = get_background_logger(__name__)
+
+class McqSchema(BaseModel):
+    """Response schema for a multiple choice question."""
+    question: str
+    options: List[str]
+    correct_answer: Literal["A", "B", "C", "D"]
+    explanation: str
+
+class TrueFalseSchema(BaseModel):
+    """Response schema for a true/false question."""
+    question: str
+    correct_answer: Literal["True", "False"]
+    explanation: str
+
+class QuizSchema(BaseModel):
+    """Response schema for a combined quiz request."""
+    multiple_choice: List[McqSchema]
+    true_false: List[TrueFalseSchema]
+
+# Free-tier request quota for gemini-2.5-flash
+DEFAULT_MAX_REQUESTS_PER_MINUTE = 10
+
+# Upper bound on text chunks (and concurrent requests) per quiz
+_MAX_CHUNKS = 8
+
+class _RateLimiter:
+    """Token bucket that spaces out request starts to stay under a per-minute quota."""
+    
+    def __init__(self, max_requests_per_minute: int):
+        self.capacity = max(1, max_requests_per_minute)
+        self.fill_rate = self.capacity / 60.0
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self) -> None:
+        """Block until a request may be sent."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.fill_rate
+            time.sleep(wait)
+
+# Page markers added during PDF extraction; used for chunking, not sent to Gemini
+_PAGE_MARKER_RE = re.compile(r'--- Page \d+ ---\n')
+
+# Start of one of the question arrays in a streamed quiz response
+_SECTION_RE = re.compile(r'"(multiple_choice|true_false)"\s*:\s*\[')
+
+class _QuestionStreamParser:
+    """Pull completed question objects out of a quiz response as it streams in."""
+    
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.section = None
+        self.decoder = json.JSONDecoder()
+    
+    def feed(self, text: str) -> List[Tuple[str, Any]]:
+        """Add streamed text and return (question_type, object) pairs completed by it."""
+        self.buffer += text
+        completed = []
+        
+        while True:
+            if self.section is None:
+                match = _SECTION_RE.search(self.buffer, self.pos)
+                if not match:
+                    break
+                self.section = match.group(1)
+                self.pos = match.end()
+            
+            # Skip separators between array items
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n,':
+                self.pos += 1
+            if self.pos >= len(self.buffer):
+                break
+            
+            if self.buffer[self.pos] == ']':
+                self.section = None
+                self.pos += 1
+                continue
+            
+            try:
+                obj, self.pos = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # The next object has not been fully received yet
+                break
+            completed.append((self.section, obj))
+        
+        return completed
+
+class _QuestionProgress:
+    """
+    Forward streamed questions to a progress callback, once per requested question.
+    
+    A retried request streams its questions again, and the model may return
+    more than were asked for, so each stream counts its questions per type and
+    only those beyond what was already reported, up to the requested count,
+    are passed on.
+    """
+    
+    def __init__(self, callback: Callable[[Dict[str, Any]], None], mc_count: int, tf_count: int):
+        self.callback = callback
+        self.quota = {'multiple_choice': mc_count, 'true_false': tf_count}
+        self.reported = dict.fromkeys(self.quota, 0)
+        self.seen = dict.fromkeys(self.quota, 0)
+    
+    def begin(self) -> None:
+        """Start counting a new (possibly retried) stream."""
+        self.seen = dict.fromkeys(self.quota, 0)
+    
+    def report(self, question: Dict[str, Any]) -> None:
+        """Count a streamed question and pass it on if it has not been reported yet."""
+        question_type = question['type']
+        self.seen[question_type] += 1
+        if self.reported[question_type] < self.seen[question_type] <= self.quota[question_type]:
+            self.reported[question_type] = self.seen[question_type]
+            self.callback(question)
+
+# HTTP status codes worth retrying after a pause (rate limited / temporarily unavailable)
+_RETRYABLE_STATUS_CODES = frozenset((429, 500, 503))
+_MAX_BACKOFF_ATTEMPTS = 5
+
+# Longest pause (seconds) worth blocking the Streamlit script thread for
+_MAX_RETRY_DELAY = 60.0
+
+def _retry_delay(error: errors.APIError, attempt: int) -> float:
+    """Seconds to wait before retrying, honoring any delay requested by the server."""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    retry_after = headers.get('Retry-After') if headers is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    
+    # Gemini reports quota delays as a RetryInfo detail, e.g. "retryDelay": "30s"
+    details = error.details.get('error', {}).get('details', []) if isinstance(error.details, dict) else []
+    for detail in details:
+        retry_delay = detail.get('retryDelay') if isinstance(detail, dict) else None
+        if isinstance(retry_delay, str) and retry_delay.endswith('s'):
+            try:
+                return float(retry_delay[:-1])
+            except ValueError:
+                pass
+    
+    # Exponential backoff with jitter
+    return 2 ** attempt + random.random()
+
+def _with_backoff(func):
+    """Retry a Gemini call on rate-limit and transient server errors with exponential backoff."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(_MAX_BACKOFF_ATTEMPTS):
+            try:
+                return func(*args, **kwargs)
+            except errors.APIError as e:
+                if e.code not in _RETRYABLE_STATUS_CODES or attempt == _MAX_BACKOFF_ATTEMPTS - 1:
+                    raise
+                delay = _retry_delay(e, attempt)
+                if delay > _MAX_RETRY_DELAY:
+                    # e.g. an exhausted daily quota; give up rather than stall the app
+                    logger.warning("Gemini asked to retry in %.1f s, not retrying", delay)
+                    raise
+                logger.warning("Gemini request failed with status %s, retrying in %.1f s", e.code, delay)
+                time.sleep(delay)
+    return wrapper
+
+@functools.lru_cache(maxsize=4)
+def _get_client(api_key: str) -> genai.Client:
+    """Return a shared Gemini client so its HTTP connection pool is reused across generators."""
+    return genai.Client(api_key=api_key)
+
+@functools.lru_cache(maxsize=4)
+def _get_rate_limiter(api_key: str, max_requests_per_minute: int) -> _RateLimiter:
+    """Return the rate limiter shared by every generator using the same API key."""
+    return _RateLimiter(max_requests_per_minute)
+
+def _split_into_chunks(text: str, target_tokens: int = 4000, max_chunks: int = _MAX_CHUNKS) -> List[str]:
+    """
+    Split text into chunks of roughly target_tokens tokens.
+    
+    Pages (and paragraphs) are separated by blank lines in the extracted text,
+    so whole blocks are packed greedily, keeping their "--- Page N ---" markers.
+    The chunk size grows for long texts so at most max_chunks are produced, and
+    the text is spread evenly over the chunks so no chunk is left as a small tail.
+    """
+    # Cheap heuristic: roughly 4 characters per token
+    target_chars = max(target_tokens * 4, -(-len(text) // max(1, max_chunks)))
+    num_chunks = -(-len(text) // target_chars)
+    target_chars = len(text) / max(1, num_chunks)
+    
+    chunks = []
+    current = []
+    current_len = 0
+    for block in text.split("\n\n"):
+        current.append(block)
+        current_len += len(block) + 2
+        # Close a chunk once it reaches the target, so there are never more than max_chunks
+        if current_len >= target_chars:
+            chunks.append("\n\n".join(current))
+            current = []
+            current_len = 0
+    
+    if current:
+        chunks.append("\n\n".join(current))
+    
+    return chunks
+
+def _apportion(total: int, weights: List[int]) -> List[int]:
+    """Split total into whole shares proportional to weights, using largest remainders."""
+    weight_sum = sum(weights) or 1
+    exact = [total * weight / weight_sum for weight in weights]
+    shares = [int(share) for share in exact]
+    # Hand out what is left to the largest remainders; ties go to earlier entries
+    by_remainder = sorted(range(len(weights)), key=lambda i: shares[i] - exact[i])
+    for i in by_remainder[:total - sum(shares)]:
+        shares[i] += 1
+    return shares
 
 class QuizGenerator:
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self, api_key: Optional[str] = None,
+                 max_requests_per_minute: int = DEFAULT_MAX_REQUESTS_PER_MINUTE):
         """Initialize the QuizGenerator with Gemini API."""
         self.api_key = api_key or os.getenv("GEMINI_API_KEY")
         if not self.api_key:
             raise ValueError("Gemini API key is required")
         
-        self.client = genai.Client(api_key=self.api_key)
-    
-    def _extract_json_from_response(self, response_text: str, question_type: str) -> List[Dict[str, Any]]:
-        """Extract and parse JSON from API response with robust error handling."""
-        try:
-            # Clean the response text
-            text = response_text.strip()
-            
-            # Remove markdown code blocks
-            if text.startswith('```json'):
-                text = text[7:]
-            elif text.startswith('```'):
-                text = text[3:]
-            if text.endswith('```'):
-                text = text[:-3]
-            text = text.strip()
-            
-            # Find JSON array boundaries
-            start_idx = text.find('[')
-            end_idx = text.rfind(']') + 1
-            
-            if start_idx != -1 and end_idx > start_idx:
-                json_text = text[start_idx:end_idx]
-                
-                # Try parsing the JSON
-                try:
-                    questions_data = json.loads(json_text)
-                    if isinstance(questions_data, list):
-                        valid_questions = []
-                        for q in questions_data:
-                            if isinstance(q, dict) and 'question' in q and 'correct_answer' in q:
-                                q['type'] = question_type
-                                valid_questions.append(q)
-                        return valid_questions
-                except json.JSONDecodeError:
-                    # Try fixing common JSON issues
-                    fixed_text = json_text.replace("'", '"')
-                    # Fix trailing commas
-                    fixed_text = re.sub(r',(\s*[}\]])', r'\1', fixed_text)
-                    try:
-                        questions_data = json.loads(fixed_text)
-                        if isinstance(questions_data, list):
-                            valid_questions = []
-                            for q in questions_data:
-                                if isinstance(q, dict) and 'question' in q and 'correct_answer' in q:
-                                    q['type'] = question_type
-                                    valid_questions.append(q)
-                            return valid_questions
-                    except json.JSONDecodeError as e:
-                        logging.error(f"JSON parsing failed after fixes: {e}")
-                        logging.error(f"Problematic JSON: {fixed_text}")
-            
-            return []
-            
-        except Exception as e:
-            logging.error(f"Error extracting JSON: {e}")
-            return []
+        self.client = _get_client(self.api_key)
+        self.rate_limiter = _get_rate_limiter(self.api_key, max_requests_per_minute)
     
     def generate_quiz(self, text: str, num_questions: int = 10, 
-                     difficulty: str = "Medium", question_types: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+                     difficulty: str = "Medium", question_types: Optional[List[str]] = None,
+                     on_question: Optional[Callable[[Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
         """
         Generate quiz questions from the provided text.
         
@@ -81,6 +261,10 @@ class QuizGenerator:
             num_questions: Number of questions to generate
             difficulty: Difficulty level (Easy, Medium, Hard)
             question_types: Types of questions to include
+            on_question: Optional callback invoked in the calling thread with each
+                question as soon as it has been streamed in, for progress display;
+                retries and surplus questions are not reported, so it is called
+                at most num_questions times
         
         Returns:
             List of question dictionaries
@@ -100,141 +284,169 @@ class QuizGenerator:
         elif "True/False" in question_types:
             tf_count = num_questions
         
-        questions = []
+        if mc_count == 0 and tf_count == 0:
+            return []
+        
+        chunks = _split_into_chunks(text, max_chunks=min(_MAX_CHUNKS, mc_count + tf_count))
+        if len(chunks) == 1:
+            # Both question types come back from a single request
+            return self._generate_questions(text, mc_count, tf_count, difficulty, on_question)
         
-        # Generate Multiple Choice Questions
-        if mc_count > 0:
-            mc_questions = self._generate_multiple_choice_questions(text, mc_count, difficulty)
-            questions.extend(mc_questions)
+        # Spread the questions over the chunks in proportion to their length and
+        # request them concurrently; true/false ties go to later chunks so the
+        # rounding leftovers of the two types land on different chunks
+        lengths = [len(chunk) for chunk in chunks]
+        mc_shares = _apportion(mc_count, lengths)
+        tf_shares = _apportion(tf_count, lengths[::-1])[::-1]
+        jobs = [
+            (chunk, chunk_mc, chunk_tf)
+            for chunk, chunk_mc, chunk_tf in zip(chunks, mc_shares, tf_shares)
+            if chunk_mc > 0 or chunk_tf > 0
+        ]
         
-        # Generate True/False Questions
-        if tf_count > 0:
-            tf_questions = self._generate_true_false_questions(text, tf_count, difficulty)
-            questions.extend(tf_questions)
-        
-        return questions
-    
-    def _generate_multiple_choice_questions(self, text: str, count: int, difficulty: str) -> List[Dict[str, Any]]:
-        """Generate multiple choice questions with retry logic."""
-        system_prompt = f"""Create exactly {count} multiple-choice questions from the text provided.
-
-CRITICAL: You must create exactly {count} questions, no more, no less.
-
-Return ONLY a valid JSON array in this exact format:
-[
-  {{
-    "question": "Your question here?",
-    "options": ["Option 1", "Option 2", "Option 3", "Option 4"],
-    "correct_answer": "A",
-    "explanation": "Brief explanation"
-  }}
-]
-
-Requirements:
-- Exactly {count} questions in the JSON array
-- Difficulty level: {difficulty}
+        with ThreadPoolExecutor(max_workers=min(len(jobs), _MAX_CHUNKS)) as executor:
+            if on_question is None:
+                results = list(executor.map(
+                    lambda job: self._generate_questions(job[0], job[1], job[2], difficulty), jobs
+                ))
+            else:
+                # Workers hand streamed questions back so the callback runs in this thread
+                streamed = queue.Queue()
+                futures = [
+                    executor.submit(self._generate_questions, chunk, chunk_mc, chunk_tf, difficulty, streamed.put)
+                    for chunk, chunk_mc, chunk_tf in jobs
+                ]
+                while not all(future.done() for future in futures) or not streamed.empty():
+                    try:
+                        on_question(streamed.get(timeout=0.1))
+                    except queue.Empty:
+                        pass
+                results = [future.result() for future in futures]
+        
+        questions = [q for chunk_questions in results for q in chunk_questions]
+        mc_questions = [q for q in questions if q['type'] == 'multiple_choice']
+        tf_questions = [q for q in questions if q['type'] == 'true_false']
+        return mc_questions[:mc_count] + tf_questions[:tf_count]
+    
+    def _build_prompt(self, mc_count: int, tf_count: int, difficulty: str) -> str:
+        """Build the system prompt for a combined multiple choice / true-false request."""
+        sections = []
+        
+        if mc_count > 0:
+            sections.append(f"""Multiple choice requirements ("multiple_choice" array):
+- Exactly {mc_count} questions
 - Each question has exactly 4 options
 - Correct answer must be A, B, C, or D
 - Include brief explanations
-- Focus on key concepts from the provided text
-- Return valid JSON only, no other text"""
+- Focus on key concepts from the provided text""")
         
-        max_retries = 2
-        for attempt in range(max_retries):
-            try:
-                response = self.client.models.generate_content(
-                    model="gemini-2.5-flash",
-                    contents=f"{system_prompt}\n\nText to analyze:\n{text}",
-                    config=types.GenerateContentConfig(
-                        temperature=0.7,
-                        max_output_tokens=8000
-                    )
-                )
-                
-                if response.text:
-                    questions = self._extract_json_from_response(response.text, 'multiple_choice')
-                    if len(questions) == count:
-                        return questions
-                    elif len(questions) > 0:
-                        # If we got some questions but not the exact count, return what we have
-                        logging.warning(f"Generated {len(questions)} questions instead of {count}")
-                        return questions[:count]  # Take only the requested number
-                
-            except Exception as e:
-                logging.error(f"Error generating multiple choice questions (attempt {attempt + 1}): {e}")
-                if attempt == max_retries - 1:
-                    return []
+        if tf_count > 0:
+            sections.append(f"""True/false requirements ("true_false" array):
+- Exactly {tf_count} questions, each a statement to evaluate as true or false
+- Correct answer must be either "True" or "False"
+- Mix of true and false answers
+- Include brief explanations
+- Focus on key facts from the provided text""")
         
-        return []
-    
-    def _generate_true_false_questions(self, text: str, count: int, difficulty: str) -> List[Dict[str, Any]]:
-        """Generate true/false questions with retry logic."""
-        system_prompt = f"""Create exactly {count} true/false questions from the text provided.
+        empty_arrays = []
+        if mc_count == 0:
+            empty_arrays.append('"multiple_choice"')
+        if tf_count == 0:
+            empty_arrays.append('"true_false"')
+        
+        requirements = "\n\n".join(sections)
+        empty_note = f"\n\nLeave {' and '.join(empty_arrays)} as an empty array." if empty_arrays else ""
+        
+        return f"""Create exactly {mc_count} multiple-choice questions and exactly {tf_count} true/false questions from the text provided.
 
-CRITICAL: You must create exactly {count} questions, no more, no less.
+CRITICAL: You must create exactly the requested number of each question type, no more, no less.
 
-Return ONLY a valid JSON array in this exact format:
-[
-  {{
-    "question": "Statement to evaluate as true or false",
-    "correct_answer": "True",
-    "explanation": "Brief explanation"
-  }}
-]
+Return a JSON object with a "multiple_choice" array and a "true_false" array.
 
-Requirements:
-- Exactly {count} questions in the JSON array
-- Difficulty level: {difficulty}
-- Correct answer must be either "True" or "False"
-- Mix of true and false answers
-- Include brief explanations
-- Focus on key facts from the provided text
-- Return valid JSON only, no other text"""
+Difficulty level: {difficulty}
+
+{requirements}{empty_note}"""
+    
+    def _generate_questions(self, text: str, mc_count: int, tf_count: int, difficulty: str,
+                            on_question: Optional[Callable[[Dict[str, Any]], None]] = None) -> List[Dict[str, Any]]:
+        """Generate multiple choice and true/false questions in one streamed request with retry logic."""
+        system_prompt = self._build_prompt(mc_count, tf_count, difficulty)
+        
+        # Page markers only cost input tokens once chunking is done
+        text = _PAGE_MARKER_RE.sub('', text)
+        
+        progress = _QuestionProgress(on_question, mc_count, tf_count) if on_question is not None else None
         
         max_retries = 2
         for attempt in range(max_retries):
             try:
-                response = self.client.models.generate_content(
-                    model="gemini-2.5-flash",
-                    contents=f"{system_prompt}\n\nText to analyze:\n{text}",
-                    config=types.GenerateContentConfig(
-                        temperature=0.7,
-                        max_output_tokens=6000
-                    )
-                )
-                
-                if response.text:
-                    questions = self._extract_json_from_response(response.text, 'true_false')
-                    if len(questions) == count:
-                        return questions
-                    elif len(questions) > 0:
+                response_text = self._stream_response(f"{system_prompt}\n\nText to analyze:\n{text}", progress)
+                if response_text:
+                    quiz_data = json.loads(response_text)
+                    mc_questions = self._tag_questions(quiz_data.get('multiple_choice', []), 'multiple_choice')
+                    tf_questions = self._tag_questions(quiz_data.get('true_false', []), 'true_false')
+                    
+                    if len(mc_questions) != mc_count or len(tf_questions) != tf_count:
                         # If we got some questions but not the exact count, return what we have
-                        logging.warning(f"Generated {len(questions)} questions instead of {count}")
-                        return questions[:count]  # Take only the requested number
+                        logger.warning(
+                            "Generated %d multiple choice and %d true/false questions instead of %d and %d",
+                            len(mc_questions), len(tf_questions), mc_count, tf_count
+                        )
+                    
+                    # Take only the requested number of each type
+                    questions = mc_questions[:mc_count] + tf_questions[:tf_count]
+                    if questions:
+                        return questions
                 
             except Exception as e:
-                logging.error(f"Error generating true/false questions (attempt {attempt + 1}): {e}")
+                logger.error("Error generating quiz questions (attempt %d): %s", attempt + 1, e)
                 if attempt == max_retries - 1:
                     return []
         
         return []
     
-    def validate_quiz_data(self, quiz_data: List[Dict[str, Any]]) -> bool:
-        """Validate the structure of quiz data."""
-        required_fields = ['question', 'correct_answer', 'type']
+    @_with_backoff
+    def _stream_response(self, contents: str, progress: Optional[_QuestionProgress] = None) -> str:
+        """Stream one quiz response, reporting completed questions to progress, and return its text."""
+        if progress is not None:
+            progress.begin()
+        self.rate_limiter.acquire()
+        stream = self.client.models.generate_content_stream(
+            model="gemini-2.5-flash",
+            contents=contents,
+            config=types.GenerateContentConfig(
+                temperature=0.7,
+                max_output_tokens=12000,
+                response_mime_type="application/json",
+                response_schema=QuizSchema
+            )
+        )
         
-        for question in quiz_data:
-            if not all(field in question for field in required_fields):
-                return False
-            
-            if question['type'] == 'multiple_choice':
-                if 'options' not in question or len(question['options']) != 4:
-                    return False
-                if question['correct_answer'] not in ['A', 'B', 'C', 'D']:
-                    return False
-            
-            elif question['type'] == 'true_false':
-                if question['correct_answer'] not in ['True', 'False']:
-                    return False
+        parser = _QuestionStreamParser()
+        response_parts = []
+        for chunk in stream:
+            if not chunk.text:
+                continue
+            response_parts.append(chunk.text)
+            completed = parser.feed(chunk.text)
+            if progress is not None:
+                for question_type, obj in completed:
+                    for question in self._tag_questions([obj], question_type):
+                        progress.report(question)
         
-        return True
+        return "".join(response_parts)
+    
+    def _tag_questions(self, questions_data: List[Any], question_type: str) -> List[Dict[str, Any]]:
+        """Keep well-formed questions and tag them with their question type."""
+        valid_questions = []
+        for q in questions_data:
+            if isinstance(q, dict) and 'question' in q and 'correct_answer' in q:
+                q['type'] = question_type
+                valid_questions.append(q)
+        return valid_questions
+    
+    def validate_quiz_data(self, quiz_data: List[Dict[str, Any]]) -> bool:
+        """Validate the structure of quiz data; see utils.validate_quiz_data."""
+        # Imported here so generating quizzes doesn't load ReportLab via utils
+        from utils import validate_quiz_data
+        return validate_quiz_data(quiz_data)
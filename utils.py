@@ -1,192 +1,283 @@
 from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak, Flowable
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.lib.colors import HexColor
 from io import BytesIO
-from typing import List, Dict, Any
+from typing import List, Dict, Any, IO, Iterator, Optional
+from copy import copy
+from html import escape
+from string import ascii_uppercase as _UC
 import datetime
+import functools
 
-def export_quiz_to_pdf(quiz_data: List[Dict[str, Any]]) -> BytesIO:
-    """
-    Export quiz data to a formatted PDF.
-    
-    Args:
-        quiz_data: List of question dictionaries
-        
-    Returns:
-        BytesIO buffer containing the PDF
-    """
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=1*inch, bottomMargin=1*inch)
-    
-    # Get styles
-    styles = getSampleStyleSheet()
-    
-    # Custom styles
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        spaceAfter=30,
-        textColor=HexColor('#dc2626'),
-        alignment=1  # Center alignment
-    )
-    
-    question_style = ParagraphStyle(
-        'QuestionStyle',
-        parent=styles['Heading2'],
-        fontSize=14,
-        spaceBefore=20,
-        spaceAfter=10,
-        textColor=HexColor('#1f2937')
-    )
-    
-    option_style = ParagraphStyle(
-        'OptionStyle',
-        parent=styles['Normal'],
-        fontSize=12,
-        leftIndent=20,
-        spaceAfter=5
-    )
-    
-    answer_style = ParagraphStyle(
-        'AnswerStyle',
-        parent=styles['Normal'],
-        fontSize=11,
-        textColor=HexColor('#059669'),
-        spaceBefore=10,
-        spaceAfter=15,
-        backColor=HexColor('#f0fdf4'),
-        borderColor=HexColor('#22c55e'),
-        borderWidth=1,
-        borderPadding=5
-    )
-    
-    # Build the PDF content
-    story = []
+# Separator lines used by the text exporter
+_SEP60 = "=" * 60
+_SEP40 = "-" * 40
+
+# Static blocks of the text export
+_HEADER = "\n".join((_SEP60, "🎯 AI GENERATED QUIZ", _SEP60))
+_INSTRUCTIONS = "\n".join((
+    "",
+    "INSTRUCTIONS:",
+    "Choose the best answer for each question.",
+    "For True/False questions, select True or False.",
+    "",
+    _SEP60,
+    "QUESTIONS",
+    _SEP60,
+    "",
+))
+_ANSWER_KEY_HEADER = "\n".join(("", _SEP60, "ANSWER KEY", _SEP60, ""))
+
+# Templates for repeated question, option and answer lines
+_Q_TMPL = "<b>Question %d:</b> %s"
+_OPT_TMPL = "%s. %s"
+_ANS_TMPL = "<b>Question %d:</b> %s"
+_ANS_EXPL_TMPL = "%s<br/><i>Explanation: %s</i>"
+_TEXT_Q_TMPL = "Question %d: %s"
+_TEXT_OPT_TMPL = "   %s. %s"
+_TEXT_EXPL_TMPL = "   Explanation: %s"
+
+# PDF styles, built once at import
+_STYLES = getSampleStyleSheet()
+
+_TITLE_STYLE = ParagraphStyle(
+    'CustomTitle',
+    parent=_STYLES['Heading1'],
+    fontSize=24,
+    spaceAfter=30,
+    textColor=HexColor('#dc2626'),
+    alignment=1  # Center alignment
+)
+
+_QUESTION_STYLE = ParagraphStyle(
+    'QuestionStyle',
+    parent=_STYLES['Heading2'],
+    fontSize=14,
+    spaceBefore=20,
+    spaceAfter=10,
+    textColor=HexColor('#1f2937')
+)
+
+_OPTION_STYLE = ParagraphStyle(
+    'OptionStyle',
+    parent=_STYLES['Normal'],
+    fontSize=12,
+    leftIndent=20,
+    spaceAfter=5
+)
+
+_ANSWER_STYLE = ParagraphStyle(
+    'AnswerStyle',
+    parent=_STYLES['Normal'],
+    fontSize=11,
+    textColor=HexColor('#059669'),
+    spaceBefore=10,
+    spaceAfter=15,
+    backColor=HexColor('#f0fdf4'),
+    borderColor=HexColor('#22c55e'),
+    borderWidth=1,
+    borderPadding=5
+)
+
+# Paragraphs that never change, parsed once. Paragraph.wrap() stores layout
+# state on the instance, so each use yields a shallow copy rather than the
+# shared object (PDFs may be built concurrently from several sessions).
+_QUIZ_TITLE = Paragraph("🎯 AI Generated Quiz", _TITLE_STYLE)
+_ANSWER_KEY_TITLE = Paragraph("📋 Answer Key", _TITLE_STYLE)
+_TRUE_PARA = Paragraph("A. True", _OPTION_STYLE)
+_FALSE_PARA = Paragraph("B. False", _OPTION_STYLE)
+
+@functools.lru_cache(maxsize=1)
+def _today_str(ordinal: int) -> str:
+    """Format a date ordinal for export headers; cached so strftime runs once per day."""
+    return datetime.date.fromordinal(ordinal).strftime("%B %d, %Y")
+
+@functools.lru_cache(maxsize=4096)
+def escape_markup(text: Any) -> str:
+    """Escape &, < and > for reportlab's paragraph markup and display HTML; cached for repeated strings."""
+    return escape(str(text), quote=False)
+
+def _answer_html(i: int, question: Dict[str, Any]) -> str:
+    """Paragraph markup for one answer key entry."""
+    answer_text = _ANS_TMPL % (i, question['correct_answer'])
+    if 'explanation' in question and question['explanation']:
+        answer_text = _ANS_EXPL_TMPL % (answer_text, escape_markup(question['explanation']))
+    return answer_text
+
+def _iter_story(quiz_data: List[Dict[str, Any]], include_answer_key: bool = True,
+                compact_answer_key: bool = False) -> Iterator[Flowable]:
+    """Yield the flowables of the quiz PDF in order."""
+    P = Paragraph
+    S = Spacer
+    question_style = _QUESTION_STYLE
+    option_style = _OPTION_STYLE
+    answer_style = _ANSWER_STYLE
+    normal_style = _STYLES['Normal']
     
     # Title
-    title = Paragraph("🎯 AI Generated Quiz", title_style)
-    story.append(title)
-    story.append(Spacer(1, 20))
+    yield copy(_QUIZ_TITLE)
+    yield S(1, 20)
     
     # Metadata
-    current_date = datetime.datetime.now().strftime("%B %d, %Y")
-    metadata = Paragraph(f"Generated on: {current_date} | Questions: {len(quiz_data)}", styles['Normal'])
-    story.append(metadata)
-    story.append(Spacer(1, 30))
+    current_date = _today_str(datetime.date.today().toordinal())
+    yield P(f"Generated on: {current_date} | Questions: {len(quiz_data)}", normal_style)
+    yield S(1, 30)
     
     # Instructions
-    instructions = Paragraph(
+    yield P(
         "<b>Instructions:</b> Choose the best answer for each question. "
         "For True/False questions, circle T for True or F for False.",
-        styles['Normal']
+        normal_style
     )
-    story.append(instructions)
-    story.append(Spacer(1, 20))
+    yield S(1, 20)
     
     # Questions
     for i, question in enumerate(quiz_data, 1):
         # Question number and text
-        question_text = f"<b>Question {i}:</b> {question['question']}"
-        story.append(Paragraph(question_text, question_style))
+        yield P(_Q_TMPL % (i, escape_markup(question['question'])), question_style)
         
         if question['type'] == 'multiple_choice':
             # Multiple choice options
-            for j, option in enumerate(question['options']):
-                option_letter = chr(65 + j)  # A, B, C, D
-                option_text = f"{option_letter}. {option}"
-                story.append(Paragraph(option_text, option_style))
+            for option_letter, option in zip(_UC, question['options']):
+                yield P(_OPT_TMPL % (option_letter, escape_markup(option)), option_style)
         
         elif question['type'] == 'true_false':
             # True/False options
-            story.append(Paragraph("A. True", option_style))
-            story.append(Paragraph("B. False", option_style))
+            yield copy(_TRUE_PARA)
+            yield copy(_FALSE_PARA)
         
-        story.append(Spacer(1, 10))
+        yield S(1, 10)
+    
+    if not include_answer_key:
+        return
     
     # Answer Key (on separate page)
-    story.append(PageBreak())
+    yield PageBreak()
+    
+    yield copy(_ANSWER_KEY_TITLE)
+    yield S(1, 20)
     
-    answer_title = Paragraph("📋 Answer Key", title_style)
-    story.append(answer_title)
-    story.append(Spacer(1, 20))
+    if compact_answer_key:
+        # One paragraph for the whole key: a single layout pass, at the cost
+        # of the answer box wrapping all answers instead of each one
+        yield P("<br/><br/>".join(_answer_html(i, question) for i, question in enumerate(quiz_data, 1)), answer_style)
+        return
     
     for i, question in enumerate(quiz_data, 1):
-        answer_text = f"<b>Question {i}:</b> {question['correct_answer']}"
-        if 'explanation' in question and question['explanation']:
-            answer_text += f"<br/><i>Explanation: {question['explanation']}</i>"
+        yield P(_answer_html(i, question), answer_style)
+        yield S(1, 5)
+
+def export_quiz_to_pdf(quiz_data: List[Dict[str, Any]], include_answer_key: bool = True,
+                       out: Optional[IO[bytes]] = None, compact_answer_key: bool = False) -> IO[bytes]:
+    """
+    Export quiz data to a formatted PDF.
+    
+    Args:
+        quiz_data: List of question dictionaries
+        include_answer_key: Whether to add the answer key on a separate page
+        out: Optional writable binary stream (e.g. an open file or a web
+            response body) to write the PDF into; ReportLab still renders
+            the whole document in memory first, so this only saves the
+            extra BytesIO copy and lets the caller choose where the bytes go
+        compact_answer_key: Render the answer key as a single paragraph,
+            which is much faster to lay out for long quizzes but draws one
+            answer box around all answers
         
-        story.append(Paragraph(answer_text, answer_style))
-        story.append(Spacer(1, 5))
+    Returns:
+        BytesIO buffer containing the PDF, rewound to the start, or `out`
+        when a stream was given
+    """
+    buffer = BytesIO() if out is None else out
+    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=1*inch, bottomMargin=1*inch)
+    
+    # Build the PDF content
+    story = list(_iter_story(quiz_data, include_answer_key, compact_answer_key))
     
     # Build PDF
     doc.build(story)
-    buffer.seek(0)
+    if out is None:
+        buffer.seek(0)
     return buffer
 
-def export_quiz_to_text(quiz_data: List[Dict[str, Any]]) -> str:
+def iter_quiz_text(quiz_data: List[Dict[str, Any]]) -> Iterator[str]:
     """
-    Export quiz data to a formatted text string.
+    Yield the lines of the formatted text export one at a time.
+    
+    Useful for writing very large quizzes straight to a file, e.g.
+    f.writelines(line + "\\n" for line in iter_quiz_text(quiz_data)).
     
     Args:
         quiz_data: List of question dictionaries
         
-    Returns:
-        Formatted text string
+    Yields:
+        Lines of the text export, without trailing newlines (static
+        header blocks are yielded as one multi-line string)
     """
-    lines = []
-    current_date = datetime.datetime.now().strftime("%B %d, %Y")
+    current_date = _today_str(datetime.date.today().toordinal())
     
     # Header
-    lines.append("=" * 60)
-    lines.append("🎯 AI GENERATED QUIZ")
-    lines.append("=" * 60)
-    lines.append(f"Generated on: {current_date}")
-    lines.append(f"Total Questions: {len(quiz_data)}")
-    lines.append("")
-    lines.append("INSTRUCTIONS:")
-    lines.append("Choose the best answer for each question.")
-    lines.append("For True/False questions, select True or False.")
-    lines.append("")
-    lines.append("=" * 60)
-    lines.append("QUESTIONS")
-    lines.append("=" * 60)
-    lines.append("")
+    yield _HEADER
+    yield f"Generated on: {current_date}"
+    yield f"Total Questions: {len(quiz_data)}"
+    yield _INSTRUCTIONS
     
     # Questions
     for i, question in enumerate(quiz_data, 1):
-        lines.append(f"Question {i}: {question['question']}")
-        lines.append("")
+        yield _TEXT_Q_TMPL % (i, question['question'])
+        yield ""
         
         if question['type'] == 'multiple_choice':
-            for j, option in enumerate(question['options']):
-                option_letter = chr(65 + j)  # A, B, C, D
-                lines.append(f"   {option_letter}. {option}")
+            for option_letter, option in zip(_UC, question['options']):
+                yield _TEXT_OPT_TMPL % (option_letter, option)
         
         elif question['type'] == 'true_false':
-            lines.append("   A. True")
-            lines.append("   B. False")
+            yield "   A. True"
+            yield "   B. False"
         
-        lines.append("")
-        lines.append("-" * 40)
-        lines.append("")
+        yield ""
+        yield _SEP40
+        yield ""
     
     # Answer Key
-    lines.append("")
-    lines.append("=" * 60)
-    lines.append("ANSWER KEY")
-    lines.append("=" * 60)
-    lines.append("")
+    yield _ANSWER_KEY_HEADER
     
     for i, question in enumerate(quiz_data, 1):
-        lines.append(f"Question {i}: {question['correct_answer']}")
+        yield _TEXT_Q_TMPL % (i, question['correct_answer'])
         if 'explanation' in question and question['explanation']:
-            lines.append(f"   Explanation: {question['explanation']}")
-        lines.append("")
+            yield _TEXT_EXPL_TMPL % question['explanation']
+        yield ""
+
+def export_quiz_to_text(quiz_data: List[Dict[str, Any]]) -> str:
+    """
+    Export quiz data to a formatted text string.
     
-    return "\n".join(lines)
+    Args:
+        quiz_data: List of question dictionaries
+        
+    Returns:
+        Formatted text string
+    """
+    return "\n".join(iter_quiz_text(quiz_data))
+
+_REQUIRED_FIELDS = ('question', 'correct_answer', 'type')
+_VALID_MC = frozenset('ABCD')
+_VALID_TF = frozenset(('True', 'False'))
+
+def _validate_mc(question: Dict[str, Any], correct_answer: str) -> bool:
+    """Check the multiple choice specific fields of a question."""
+    options = question.get('options')
+    return isinstance(options, list) and len(options) == 4 and correct_answer in _VALID_MC
+
+def _validate_tf(question: Dict[str, Any], correct_answer: str) -> bool:
+    """Check the true/false specific fields of a question."""
+    return correct_answer in _VALID_TF
+
+_VALIDATORS = {
+    'multiple_choice': _validate_mc,
+    'true_false': _validate_tf,
+}
 
 def validate_question_data(question: Dict[str, Any]) -> bool:
     """
@@ -198,29 +289,64 @@ def validate_question_data(question: Dict[str, Any]) -> bool:
     Returns:
         True if valid, False otherwise
     """
-    required_fields = ['question', 'correct_answer', 'type']
-    
-    # Check required fields
-    if not all(field in question for field in required_fields):
+    # Look each field up once; a missing type or answer comes back as None
+    question_type = question.get('type')
+    validator = _VALIDATORS.get(question_type) if isinstance(question_type, str) else None
+    if validator is None or 'question' not in question:
+        return False  # Missing fields or unknown question type
+    
+    # Set lookups raise on unhashable values, so only strings can be valid answers
+    correct_answer = question.get('correct_answer')
+    if not isinstance(correct_answer, str):
         return False
     
     # Check question type specific requirements
-    if question['type'] == 'multiple_choice':
-        if 'options' not in question:
-            return False
-        if not isinstance(question['options'], list) or len(question['options']) != 4:
-            return False
-        if question['correct_answer'] not in ['A', 'B', 'C', 'D']:
-            return False
+    return validator(question, correct_answer)
+
+def validate_quiz_data(quiz_data: List[Dict[str, Any]]) -> bool:
+    """
+    Validate every question in a quiz, stopping at the first invalid one.
     
+    Args:
+        quiz_data: List of question dictionaries
+        
+    Returns:
+        True if all questions are valid, False otherwise
+    """
+    return all(validate_question_data(question) for question in quiz_data)
+
+_CORRECT_STYLE = 'style="color: #22c55e; font-weight: bold;"'
+
+def _render_question_html(i: int, question: Dict[str, Any]) -> str:
+    """Render one question as an HTML fragment."""
+    if question['type'] == 'multiple_choice':
+        correct = question['correct_answer']
+        choices = ''.join((
+            '<ul>',
+            ''.join(
+                f'<li {_CORRECT_STYLE if option_letter == correct else ""}>{option_letter}. {escape_markup(option)}</li>'
+                for option_letter, option in zip(_UC, question['options'])
+            ),
+            '</ul>',
+        ))
     elif question['type'] == 'true_false':
-        if question['correct_answer'] not in ['True', 'False']:
-            return False
-    
+        correct = question['correct_answer']
+        choices = ''.join((
+            f'<p {_CORRECT_STYLE if correct == "True" else ""}>True</p>',
+            f'<p {_CORRECT_STYLE if correct == "False" else ""}>False</p>',
+        ))
     else:
-        return False  # Unknown question type
+        choices = ''
     
-    return True
+    explanation = f'<p><strong>Explanation:</strong> {escape_markup(question["explanation"])}</p>' if 'explanation' in question else ''
+    
+    return ''.join((
+        '<div class="quiz-question">',
+        f'<h4>Question {i}: {escape_markup(question["question"])}</h4>',
+        choices,
+        explanation,
+        '</div><hr>',
+    ))
 
 def format_quiz_for_display(quiz_data: List[Dict[str, Any]]) -> str:
     """
@@ -232,34 +358,7 @@ def format_quiz_for_display(quiz_data: List[Dict[str, Any]]) -> str:
     Returns:
         Formatted HTML string
     """
-    html_parts = []
-    
-    for i, question in enumerate(quiz_data, 1):
-        html_parts.append(f'<div class="quiz-question">')
-        html_parts.append(f'<h4>Question {i}: {question["question"]}</h4>')
-        
-        if question['type'] == 'multiple_choice':
-            html_parts.append('<ul>')
-            for j, option in enumerate(question['options']):
-                option_letter = chr(65 + j)
-                is_correct = option_letter == question['correct_answer']
-                style = 'style="color: #22c55e; font-weight: bold;"' if is_correct else ''
-                html_parts.append(f'<li {style}>{option_letter}. {option}</li>')
-            html_parts.append('</ul>')
-        
-        elif question['type'] == 'true_false':
-            correct = question['correct_answer']
-            true_style = 'style="color: #22c55e; font-weight: bold;"' if correct == 'True' else ''
-            false_style = 'style="color: #22c55e; font-weight: bold;"' if correct == 'False' else ''
-            html_parts.append(f'<p {true_style}>True</p>')
-            html_parts.append(f'<p {false_style}>False</p>')
-        
-        if 'explanation' in question:
-            html_parts.append(f'<p><strong>Explanation:</strong> {question["explanation"]}</p>')
-        
-        html_parts.append('</div><hr>')
-    
-    return ''.join(html_parts)
+    return ''.join(_render_question_html(i, question) for i, question in enumerate(quiz_data, 1))
 
 def get_quiz_statistics(quiz_data: List[Dict[str, Any]]) -> Dict[str, Any]:
     """
@@ -275,17 +374,26 @@ def get_quiz_statistics(quiz_data: List[Dict[str, Any]]) -> Dict[str, Any]:
         return {}
     
     total_questions = len(quiz_data)
-    mc_count = sum(1 for q in quiz_data if q['type'] == 'multiple_choice')
-    tf_count = sum(1 for q in quiz_data if q['type'] == 'true_false')
     
-    # Count explanations
-    with_explanations = sum(1 for q in quiz_data if q.get('explanation', '').strip())
+    # Count question types and explanations in a single pass
+    mc_count = tf_count = with_explanations = 0
+    for q in quiz_data:
+        question_type = q['type']
+        if question_type == 'multiple_choice':
+            mc_count += 1
+        elif question_type == 'true_false':
+            tf_count += 1
+        explanation = q.get('explanation')
+        if explanation and not explanation.isspace():
+            with_explanations += 1
+    
+    inv_total = 100.0 / total_questions
     
     return {
         'total_questions': total_questions,
         'multiple_choice': mc_count,
         'true_false': tf_count,
         'with_explanations': with_explanations,
-        'mc_percentage': round((mc_count / total_questions) * 100, 1) if total_questions > 0 else 0,
-        'tf_percentage': round((tf_count / total_questions) * 100, 1) if total_questions > 0 else 0
-    }
+        'mc_percentage': round(mc_count * inv_total, 1),
+        'tf_percentage': round(tf_count * inv_total, 1)
+    }
\ No newline at end of file